@@ -3,83 +3,188 @@
 import re
 import sys
 import argparse
-from typing import Dict, Tuple
+from itertools import islice
+from typing import Callable, Dict, FrozenSet, Iterator, List, Match, Optional, Pattern, Tuple
 
+try:
+    import hyperscan
+except ImportError:  # optional, extraction falls back to plain re
+    hyperscan = None  # type: ignore[assignment]
 
-def extract_batch_variables(text: str) -> Dict[str, str]:
+# Precompiled patterns used by the extraction/substitution passes
+_SET_Q = re.compile(r'[a-z]et\s+"([^"=]+)=([^"]*)"', re.IGNORECASE)  # set "var=value"
+_SET_NQ = re.compile(r'[a-z]et\s+([^"=\s]+)=([^\s&]*)', re.IGNORECASE)  # set var=value (no quotes, stops at space or &)
+_FOR_SINGLE = re.compile(r'\(for\s+%([a-z]+)\s+in\s+\("?([^"]*)"?\)\s+do\s+@set\s+"([a-z]+)=%~[a-z]+"\s?\)', re.IGNORECASE)
+_FOR_MULTI = re.compile(r'\(for\s+%[a-z]+\s+in\s+\(([^)]+)\)\s+do\s+@set\s+%~[a-z]+\)', re.IGNORECASE)
+_ASSIGN = re.compile(r'"([^"=]+)=([^"]*)"')
+_SUBST = re.compile(r'[!%](\w+)[!%]')
+_REMOVE_VAR = re.compile(r'\s*[a-z]et\s+"[^"]+"\s*&&\s*', re.IGNORECASE)
+_AMP = re.compile(r'\s*&&\s*')
+
+# Every extractor scans the whole text on its own: matches of different
+# patterns may overlap (a FOR loop or an unquoted set inside a quoted set
+# value), and a shared alternation would consume one of them
+_EXTRACTORS = (
+    ('setq', _SET_Q),
+    ('setnq', _SET_NQ),
+    ('forone', _FOR_SINGLE),
+    ('formul', _FOR_MULTI),
+)
+
+_SUBST_sub = _SUBST.sub
+
+# Optional: Hyperscan scans for all extractors at once to locate candidates.
+# The trailing value of set var=value may end at every offset, so Hyperscan
+# would report each of them; it can always match empty, so the prefix up to
+# '=' finds the same starts with a single report each
+if hyperscan is not None:
+    _HS_EXPRESSIONS = [
+        pattern.pattern.removesuffix(r'([^\s&]*)') if pattern is _SET_NQ else pattern.pattern
+        for _, pattern in _EXTRACTORS
+    ]
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=[expression.encode('ascii') for expression in _HS_EXPRESSIONS],
+        ids=list(range(len(_EXTRACTORS))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(_EXTRACTORS),
+    )
+else:
+    _HS_DB = None
+
+_HS_UNSUPPORTED = '\x1c\x1d\x1e\x1f'
+
+
+def _finditer_extract(text: str) -> Iterator[Tuple[str, Match[str]]]:
     """
-    Extract batch variable assignments from 'set "var=value"' patterns.
-    
-    Args:
-        text: Input batch text
-        
-    Returns:
-        Dictionary of variable assignments
+    Yield (kind, match) for the finditer matches of every extractor, using
+    Hyperscan (when installed) to skip over regions without any assignment.
     """
-    variables = {}
+    # Hyperscan reports byte offsets, which equal str indices only for ASCII,
+    # and its \s lacks the \x1c-\x1f separators that re's Unicode \s covers
+    if _HS_DB is None or not text.isascii() or any(c in text for c in _HS_UNSUPPORTED):
+        for kind, pattern in _EXTRACTORS:
+            for match in pattern.finditer(text):
+                yield kind, match
+        return
     
-    # Match: set "variable=value" (with optional spaces and case insensitive)
-    # Also match: set variable=value (without quotes)
-    patterns = [
-        r'(?i)[a-z]et\s+"([^"=]+)=([^"]*)"',  # set "var=value"
-        r'(?i)[a-z]et\s+([^"=\s]+)=([^\s&]*)',  # set var=value (no quotes, stops at space or &)
-    ]
+    # Hyperscan reports (leftmost start, end) pairs, not captures. Collapse
+    # them per extractor into sorted, disjoint regions as they arrive
+    regions: List[List[Tuple[int, int]]] = [[] for _ in _EXTRACTORS]
+    unordered = False
     
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        for var_name, var_value in matches:
-            variables[var_name.strip()] = var_value.strip()
+    def on_match(id_: int, start: int, end: int, flags: int, context: object) -> None:
+        nonlocal unordered
+        merged = regions[id_]
+        if merged and end < merged[-1][1]:
+            # Not in end-offset order; merged once the scan is done
+            unordered = True
+            merged.append((start, end))
+            return
+        while merged and start <= merged[-1][1]:
+            start = min(start, merged.pop()[0])
+        merged.append((start, end))
     
-    return variables
+    _HS_DB.scan(text.encode('ascii'), match_event_handler=on_match)
+    
+    for (kind, pattern), pattern_regions in zip(_EXTRACTORS, regions):
+        if unordered:
+            pattern_regions = _merge_regions(pattern_regions)
+        for match in _search_regions(pattern, text, pattern_regions):
+            yield kind, match
+
+
+def _merge_regions(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Collapse overlapping or touching spans into sorted, disjoint regions."""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _search_regions(pattern: Pattern[str], text: str, regions: List[Tuple[int, int]]) -> Iterator[Match[str]]:
+    """Yield pattern's finditer matches, searching only from Hyperscan regions."""
+    # Any match starting at or after pos lies inside a region ending past
+    # pos, so it cannot start before the first such region; let re recover
+    # the groups from there
+    search = pattern.search
+    pos = i = 0
+    while True:
+        while i < len(regions) and regions[i][1] <= pos:
+            i += 1
+        if i == len(regions):
+            return
+        match = search(text, max(pos, regions[i][0]))
+        if match is None:
+            return
+        yield match
+        pos = match.end()
 
-def adjust_for_loop_substitutions(text: str, variables: Dict[str, str]) -> Dict[str, str]:
+
+def extract_all_variables(text: str) -> Dict[str, str]:
     """
-    Extract FOR loop patterns and adjust variable substitutions.
+    Extract variable assignments from all supported patterns: 'set "var=value"',
+    'set var=value', single-variable FOR loops and multi-assignment FOR
+    loops like:
+    (for %g in ("var1=val1" "var2=val2" ...) do @set %~g)
+    
+    Args:
+        text: Input batch text
+        
+    Returns:
+        Dictionary of variable assignments
     """
-    # Updated regex to handle quoted values and capture loop variable correctly
-    for_pattern = r'(?i)\(for\s+%([a-z]+)\s+in\s+\("?([^"]*)"?\)\s+do\s+@set\s+"([a-z]+)=%~[a-z]+"\s?\)'
-    matches = re.findall(for_pattern, text)
+    # One bucket per pattern kind, merged below so that FOR loops keep
+    # precedence over plain set assignments as in separate passes
+    quoted, unquoted, loops, multi = {}, {}, {}, {}
     
-    for match in matches:
-        if len(match) == 3:
-            loop_var, value, target_var = match
+    for kind, match in _finditer_extract(text):
+        if kind == 'setq':
+            var_name, var_value = match.groups()
+            quoted[var_name.strip()] = var_value.strip()
+        elif kind == 'setnq':
+            # Neither capture can contain whitespace, no strip needed
+            var_name, var_value = match.groups()
+            unquoted[var_name] = var_value
+        elif kind == 'forone':
+            loop_var, value, target_var = match.groups()
             # Remove quotes from value if present
             value = value.strip('"')
-            variables[loop_var] = value          # z = s
-            variables[target_var] = value        # Outlip = s
-        
-    return variables
-
-def extract_multi_assignment_for_loops(text: str, variables: Dict[str, str]) -> Dict[str, str]:
-    """
-    Extract FOR loops that set multiple variables like:
-    (for %g in ("var1=val1" "var2=val2" ...) do @set %~g)
-    """
-    # Match FOR loops with multiple quoted assignments
-    pattern = r'(?i)\(for\s+%[a-z]+\s+in\s+\(([^)]+)\)\s+do\s+@set\s+%~[a-z]+\)'
-    matches = re.findall(pattern, text)
-    
-    for assignments_str in matches:
-        # Extract all "var=value" patterns from the string
-        assignment_pattern = r'"([^"=]+)=([^"]*)"'
-        assignments = re.findall(assignment_pattern, assignments_str)
-        
-        for var_name, var_value in assignments:
-            variables[var_name.strip()] = var_value.strip()
+            loops[loop_var] = value          # z = s
+            loops[target_var] = value        # Outlip = s
+        else:
+            # Extract all "var=value" patterns from the loop list only
+            for var_name, var_value in _ASSIGN.findall(match.group(1)):
+                multi[var_name.strip()] = var_value.strip()
+    
+    variables = quoted
+    variables.update(unquoted)
+    variables.update(loops)
+    variables.update(multi)
     
     return variables
 
-def substitute_variables(text: str, variables: Dict[str, str]) -> Tuple[str, bool]:
+def substitute_variables(text: str, variables: Dict[str, str], max_passes: int = 50,
+                         _sub: Callable[..., str] = _SUBST_sub) -> Tuple[str, bool]:
     original_text = text
     
-    def replace_var(match):
-        var_name = match.group(1)
-        return variables.get(var_name, match.group(0))
+    # Bind the lookup as a local default; the callback fires once per match.
+    # Only build the unchanged match text on a miss
+    def replace_var(match: Match[str], _get: Callable[[str], Optional[str]] = variables.get) -> str:
+        value = _get(match.group(1))
+        return value if value is not None else match.group(0)
     
-    # Process substitutions in the order they appear in text, not definition order
-    result = re.sub(r'[!%](\w+)[!%]', replace_var, text)
+    # Process substitutions in the order they appear in text, not definition order.
+    # Repeat until nested expansions are resolved (bounded for self-referencing values)
+    for _ in range(max_passes):
+        result = _sub(replace_var, text)
+        if result == text:
+            break
+        text = result
     
-    return result, result != original_text
+    return text, text != original_text
 
 def deobfuscate_batch(text: str, max_iterations: int = 50, verbose: bool = False) -> str:
     """
@@ -95,34 +200,39 @@ def deobfuscate_batch(text: str, max_iterations: int = 50, verbose: bool = False
     """
     current_text = text
     iteration = 0
+    prev_keys: FrozenSet[str] = frozenset()
+    # Split the original only once; used for the cumulative change count
+    orig_lines = text.split('\n') if verbose else []
     
     if verbose:
-        print(f"Starting deobfuscation...")
+        print("Starting deobfuscation...")
     
     while iteration < max_iterations:
         iteration += 1
         
-        # Extract variables from current state
-        variables = extract_batch_variables(current_text)
-
-        # Adjust variables based on FOR loops
-        variables = adjust_for_loop_substitutions(current_text, variables)
-
-        
-        # Extract multi-assignment FOR loops
-        variables = extract_multi_assignment_for_loops(current_text, variables)
+        # Extract variables (set assignments and FOR loops) from current state
+        variables = extract_all_variables(current_text)
 
         if not variables:
             if verbose:
                 print(f"No variables found in iteration {iteration}, stopping.")
             break
         
+        # Substitution already ran to a fixed point with these names; stop
+        # once no new ones appear, even if a value changed after substitution
+        if variables.keys() <= prev_keys:
+            if verbose:
+                print(f"No new variables found in iteration {iteration}, stopping.")
+            break
+        prev_keys = frozenset(variables)
+        
         if verbose:
-            print(f"Iteration {iteration}: Found {len(variables)} variables")
-            for var, val in list(variables.items())[:5]:  # Show first 5
-                print(f"  {var} = {val}")
+            # Show first 5, formatted lazily and printed as one block
+            preview = [f"Iteration {iteration}: Found {len(variables)} variables"]
+            preview.extend(f"  {var} = {val}" for var, val in islice(variables.items(), 5))
             if len(variables) > 5:
-                print(f"  ... and {len(variables) - 5} more")
+                preview.append(f"  ... and {len(variables) - 5} more")
+            print('\n'.join(preview))
         
         # Perform substitution
         new_text, changed = substitute_variables(current_text, variables)
@@ -136,7 +246,7 @@ def deobfuscate_batch(text: str, max_iterations: int = 50, verbose: bool = False
         
         # Show a preview of changes
         if verbose:
-            lines_changed = sum(1 for old, new in zip(text.split('\n'), current_text.split('\n')) if old != new)
+            lines_changed = sum(1 for old, new in zip(orig_lines, current_text.split('\n')) if old != new)
             print(f"  Changed {lines_changed} lines")
     
     if verbose:
@@ -148,7 +258,10 @@ def deobfuscate_batch(text: str, max_iterations: int = 50, verbose: bool = False
 
 def remove_variable_assignments(text: str) -> str:
     """Remove variable assignment lines from the text."""
-    return re.sub(r'\s*[a-z]et\s+"[^"]+"\s*&&\s*', '', text, flags=re.IGNORECASE)
+    # Every assignment match ends in &&; a substring test is much cheaper
+    if '&&' not in text:
+        return text
+    return _REMOVE_VAR.sub('', text)
 
 def clean_output(text: str) -> str:
     """
@@ -160,27 +273,21 @@ def clean_output(text: str) -> str:
     Returns:
         Cleaned text
     """
+    # Nothing to normalize or split without any && separator
+    if '&&' not in text:
+        return text
+    
     # Remove excessive && chains and normalize whitespace
-    cleaned = re.sub(r'\s*&&\s*', ' && ', text)
-    
-    # Split long lines at && for better readability
-    lines = []
-    for line in cleaned.split('\n'):
-        if len(line) > 120 and ' && ' in line:
-            parts = line.split(' && ')
-            for i, part in enumerate(parts):
-                if i == 0:
-                    lines.append(part + ' &&')
-                elif i == len(parts) - 1:
-                    lines.append('  ' + part)
-                else:
-                    lines.append('  ' + part + ' &&')
-        else:
-            lines.append(line)
+    cleaned = _AMP.sub(' && ', text)
     
-    return '\n'.join(lines)
+    # Split long lines at && for better readability: every part but the last
+    # keeps a trailing &&, continuation parts are indented
+    return '\n'.join(
+        ' &&\n  '.join(line.split(' && ')) if len(line) > 120 and ' && ' in line else line
+        for line in cleaned.split('\n')
+    )
 
-def main():
+def main() -> None:
     """Main function with argument parsing and stdin support"""
     parser = argparse.ArgumentParser(description='Deobfuscate batch files with layered substitution')
     parser.add_argument('file', nargs='?', help='Path to file (if not provided, reads from stdin)')
@@ -194,12 +301,15 @@ def main():
                        help='Keep variable assignment lines in output')
     args = parser.parse_args()
     
-    # Read content from file or stdin
+    # Read raw bytes from file or stdin and decode them once
     if args.file:
-        with open(args.file, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+        with open(args.file, 'rb') as f:
+            content = f.read().decode('utf-8', 'ignore')
+        # Translate newlines the way text mode did for files
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
     else:
-        content = sys.stdin.read()
+        content = sys.stdin.buffer.read().decode('utf-8', 'ignore')
     
     # Deobfuscate
     deobfuscated = deobfuscate_batch(content, args.max_iterations, args.verbose)
@@ -214,11 +324,13 @@ def main():
     
     # Only show header in verbose mode
     if args.verbose:
-        print("\n" + "="*80)
-        print("DEOBFUSCATED OUTPUT:")
-        print("="*80)
+        sys.stdout.write("\n" + "="*80 + "\nDEOBFUSCATED OUTPUT:\n" + "="*80 + "\n")
     
-    print(deobfuscated)
+    # Write the result straight to the binary buffer; flush pending text first
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    out.write(deobfuscated.encode('utf-8', 'ignore'))
+    out.write(b'\n')
 
 if __name__ == "__main__":
     main()
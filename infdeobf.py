@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
 import re
-from typing import Dict, Tuple
+from functools import lru_cache
+from typing import Dict, FrozenSet, Pattern, Tuple
+
+# Assignment line: optional spaces, word, optional spaces, =, optional spaces, any chars
+_LINE = re.compile(r'^[^\S\n]*(\w+)[^\S\n]*=[^\S\n]*(.*)$', re.MULTILINE)
 
 def extract_substitutions(buffer: str) -> Tuple[Dict[str, str], str]:
     """
@@ -13,23 +17,34 @@ def extract_substitutions(buffer: str) -> Tuple[Dict[str, str], str]:
     Returns:
         Tuple of (substitutions dict, modified buffer)
     """
-    lines = buffer.split('\n')
     substitutions = {}
-    modified_lines = []
+    kept = []
+    pos = 0
+    
+    for match in _LINE.finditer(buffer):
+        key, value = match.groups()
+        # Clean up the value (remove quotes and extra whitespace)
+        substitutions[key] = value.strip().strip('\'"')
+        start, end = match.span()
+        kept.append(buffer[pos:start])
+        # Drop the matched line together with its trailing newline
+        pos = end + 1
     
-    # Regex pattern: optional spaces, word, optional spaces, =, optional spaces, any chars
-    pattern = r'^\s*(\w+)\s*=\s*(.*)$'
+    kept.append(buffer[pos:])
+    modified_buffer = ''.join(kept)
     
-    for line in lines:
-        match = re.match(pattern, line)
-        if match:
-            key, value = match.groups()
-            # Clean up the value (remove quotes and extra whitespace)
-            substitutions[key] = value.strip().strip('\'"')
-        else:
-            modified_lines.append(line)
+    # Last line was removed: drop the newline that preceded it
+    if pos > len(buffer) and modified_buffer.endswith('\n'):
+        modified_buffer = modified_buffer[:-1]
     
-    return substitutions, '\n'.join(modified_lines)
+    return substitutions, modified_buffer
+
+@lru_cache(maxsize=128)
+def _substitution_pattern(keys: FrozenSet[str]) -> Pattern[str]:
+    """Compile (once per key set) the alternation matching any %key%."""
+    # Longest keys first so the alternation prefers the longest name
+    ordered = sorted(keys, key=len, reverse=True)
+    return re.compile('%(' + '|'.join(re.escape(k) for k in ordered) + ')%')
 
 def deobfuscate(buffer: str, substitutions: Dict[str, str]) -> str:
     """
@@ -42,16 +57,44 @@ def deobfuscate(buffer: str, substitutions: Dict[str, str]) -> str:
     Returns:
         Deobfuscated text
     """
-    result = buffer
+    if not substitutions:
+        return buffer
+    
+    pattern = _substitution_pattern(frozenset(substitutions))
+    
+    # Replacing variables one after another in definition order expands a
+    # reference inside a value only if that variable comes later; resolve
+    # each value once with the same rule (this also leaves self-references
+    # and cycles as literal %name%)
+    order = {key: rank for rank, key in enumerate(substitutions)}
+    resolved: Dict[str, str] = {}
     
-    # Replace each %variable% with its substitution value
-    for key, value in substitutions.items():
-        pattern = f'%{key}%'
-        result = result.replace(pattern, value)
+    def resolve(root: str) -> str:
+        # Iterative depth-first resolution; references only ever point to
+        # later variables, so the walk cannot loop
+        stack = [root]
+        while stack:
+            key = stack[-1]
+            if key in resolved:
+                stack.pop()
+                continue
+            rank = order[key]
+            value = substitutions[key]
+            pending = [name for name in pattern.findall(value) if order[name] > rank and name not in resolved]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            resolved[key] = pattern.sub(
+                lambda match: resolved[match.group(1)] if order[match.group(1)] > rank else match.group(0),
+                value,
+            )
+        return resolved[root]
     
-    return result
+    # Replace every %variable% in a single pass
+    return pattern.sub(lambda match: resolve(match.group(1)), buffer)
 
-def main():
+def main() -> None:
     """Main function with argument parsing and stdin support"""
     import sys
     import argparse
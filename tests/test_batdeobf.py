@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from pathlib import Path
+
+BATDEOBF = Path(__file__).resolve().parent.parent / 'batdeobf.py'
+
+
+def run_batdeobf(text: str, *args: str) -> str:
+    result = subprocess.run(
+        [sys.executable, str(BATDEOBF), *args],
+        input=text.encode('utf-8'),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return result.stdout.decode('utf-8')
+
+
+def test_assignment_removal_then_amp_normalization() -> None:
+    # Removing the assignment leaves a bare && behind that still has to be
+    # normalized
+    assert run_batdeobf('echo a&set "v=1"&&&echo b') == 'echo a && echo b\n'